@@ -6,8 +6,11 @@ import numpy as np
 
 RAW_DIR = "data/raw/current"
 FEATURES_PATH = "data/processed/features.csv"
+TEAM_GW_PATH = "data/processed/team_gw.csv"
 
 ROLL_COLS = ["total_points","minutes","goals_scored","assists","clean_sheets","bps"]
+TEAM_ROLL_COLS = ["goals_for","goals_conceded","clean_sheet"]
+TEAM_GW_COLS = ["team_id","GW","fixture_id","opponent_id","n_fixtures"] + TEAM_ROLL_COLS
 
 def make_rollings(df):
     # sort by GW and compute rolling means on PRIOR weeks (shift(1))
@@ -23,6 +26,141 @@ def make_rollings(df):
     df[roll_cols] = df[roll_cols].fillna(0)
     return df
 
+def _mode(s):
+    s = s.dropna()
+    return s.mode().iloc[0] if not s.empty else np.nan
+
+def build_team_gw(df):
+    # one row per (team_id, GW) from the player rows of that week
+    df = df.dropna(subset=["team_id","GW"]).copy()
+    if df.empty:
+        return pd.DataFrame(columns=TEAM_GW_COLS)
+    df["team_id"] = df["team_id"].astype(int)
+    df["GW"] = df["GW"].astype(int)
+
+    # keep only the team's majority fixture: transferred players can carry their
+    # old club's fixture (and its goals conceded). -1 = no single fixture (DGW/blank)
+    df["fx_key"] = df["fixture_id"].fillna(-1)
+    majority = df.groupby(["team_id","GW"])["fx_key"].transform(lambda s: s.mode().iloc[0])
+    df = df[df["fx_key"] == majority]
+
+    agg = df.groupby(["team_id","GW"]).agg(
+        fixture_id=("fixture_id","first"),
+        opponent_id=("opponent_team", _mode),
+        minutes=("minutes","sum"),
+        scored=("goals_scored","sum"),
+        goals_conceded=("goals_conceded","max"),
+        clean_sheets=("clean_sheets","max"),
+    ).reset_index()
+
+    # blank GW, or fixture not played yet: nobody has minutes, so there is no match
+    agg = agg[agg["minutes"] > 0].reset_index(drop=True)
+    # fetch_gw leaves fixture_id empty for a DGW and sums stats over both games
+    agg["n_fixtures"] = np.where(agg["fixture_id"].isna(), 2, 1)
+    agg.loc[agg["n_fixtures"] > 1, "opponent_id"] = np.nan
+
+    # opponent_team is often empty in live data: recover it from the shared fixture
+    fx = agg[["GW","fixture_id","team_id"]].dropna(subset=["fixture_id"])
+    pairs = fx.merge(fx, on=["GW","fixture_id"], suffixes=("","_other"))
+    pairs = pairs[pairs["team_id"] != pairs["team_id_other"]]
+    pairs = pairs.drop_duplicates(subset=["team_id","GW"]).set_index(["team_id","GW"])["team_id_other"]
+    agg = agg.set_index(["team_id","GW"])
+    agg["opponent_id"] = agg["opponent_id"].fillna(pairs)
+    agg = agg.reset_index()
+
+    # goals for = what a single-fixture opponent conceded (includes own goals),
+    # else sum of scorers (DGW: no own goals, averaged per fixture)
+    single = agg[agg["n_fixtures"] == 1].set_index(["team_id","GW"])["goals_conceded"]
+    opp_key = pd.MultiIndex.from_arrays([agg["opponent_id"], agg["GW"]])
+    agg["goals_for"] = single.reindex(opp_key).to_numpy()
+    agg["goals_for"] = agg["goals_for"].fillna(agg["scored"] / agg["n_fixtures"])
+    agg["clean_sheet"] = np.where(
+        agg["n_fixtures"] == 1,
+        (agg["goals_conceded"] == 0).astype(float),
+        agg["clean_sheets"] / agg["n_fixtures"],
+    )
+    agg["goals_conceded"] = agg["goals_conceded"] / agg["n_fixtures"]
+    return agg[TEAM_GW_COLS]
+
+def update_team_gw(combined, gw):
+    # incremental: only (re)aggregate this GW plus any GWs missing from the table
+    if os.path.exists(TEAM_GW_PATH):
+        table = pd.read_csv(TEAM_GW_PATH)
+        known = set(table["GW"].astype(int))
+    else:
+        table = pd.DataFrame(columns=TEAM_GW_COLS)
+        known = set()
+    # history rows have no team_id and never make it into the table
+    current = combined.dropna(subset=["team_id","GW"])
+    todo = current["GW"].isin({gw} | (set(current["GW"].astype(int)) - known))
+    fresh = build_team_gw(current[todo])
+    if table.empty:
+        table = fresh
+    elif not fresh.empty:
+        table = pd.concat([table, fresh], ignore_index=True)
+    table = table.drop_duplicates(subset=["team_id","GW"], keep="last")
+    table = table.sort_values(["team_id","GW"]).reset_index(drop=True)
+
+    # rolling attack/defence form on PRIOR weeks, same convention as make_rollings
+    for col in TEAM_ROLL_COLS:
+        table[f"roll3_{col}"] = (
+            table.groupby("team_id")[col]
+                 .transform(lambda s: s.shift(1).rolling(3, min_periods=1).mean())
+        )
+    os.makedirs(os.path.dirname(TEAM_GW_PATH), exist_ok=True)
+    table.to_csv(TEAM_GW_PATH, index=False)
+    return table
+
+def team_gw_index(table):
+    # dense (team_id, GW) -> row position lookup, -1 where the pair is unknown
+    teams = table["team_id"].astype(int).to_numpy()
+    gws = table["GW"].astype(int).to_numpy()
+    index = np.full((teams.max() + 1, gws.max() + 1), -1, dtype=np.int64)
+    index[teams, gws] = np.arange(len(table))
+    return index
+
+def lookup_rows(index, team_ids, gws):
+    team_ids = np.asarray(team_ids, dtype=float)
+    gws = np.asarray(gws, dtype=float)
+    ok = ~(np.isnan(team_ids) | np.isnan(gws))
+    t = np.where(ok, team_ids, -1).astype(np.int64)
+    g = np.where(ok, gws, -1).astype(np.int64)
+    ok &= (t >= 0) & (t < index.shape[0]) & (g >= 0) & (g < index.shape[1])
+    rows = np.full(len(t), -1, dtype=np.int64)
+    rows[ok] = index[t[ok], g[ok]]
+    return rows
+
+def join_team_features(df, table):
+    # attach team and opponent rolling form via integer positions, no string merges.
+    # NaN where there is nothing to look up: 0.0 would read as "conceded nothing"
+    roll_cols = [f"roll3_{c}" for c in TEAM_ROLL_COLS]
+    team_cols = [f"team_{c}" for c in roll_cols]
+    opp_cols = [f"opp_{c}" for c in roll_cols]
+    if table.empty:
+        df[team_cols + opp_cols] = np.nan
+        return df
+    index = team_gw_index(table)
+    values = table[roll_cols].to_numpy(dtype=float)
+
+    team_rows = lookup_rows(index, df["team_id"], df["GW"])
+    # the table has no season key: history rows (no team_id) must not pick up
+    # current-season form through their last-season opponent_team ids
+    opp_ids = df["opponent_team"].to_numpy(dtype=float, copy=True)
+    opp_ids[df["team_id"].isna().to_numpy()] = np.nan
+    # fall back to the fixture-derived opponent when the player row has none
+    derived = table["opponent_id"].to_numpy(dtype=float)
+    has_team = team_rows >= 0
+    missing = np.isnan(opp_ids) & has_team
+    opp_ids[missing] = derived[team_rows[missing]]
+    opp_rows = lookup_rows(index, opp_ids, df["GW"])
+
+    for cols, rows in ((team_cols, team_rows), (opp_cols, opp_rows)):
+        out = np.full((len(df), len(roll_cols)), np.nan)
+        hit = rows >= 0
+        out[hit] = values[rows[hit]]
+        df[cols] = out
+    return df
+
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument("--gw", type=int, required=True, help="Gameweek to append (e.g., 1)")
@@ -54,10 +192,13 @@ def main():
         combined = new_gw
 
     combined = make_rollings(combined)
+    team_gw = update_team_gw(combined, args.gw)
+    combined = join_team_features(combined, team_gw)
     os.makedirs(os.path.dirname(FEATURES_PATH), exist_ok=True)
     combined.to_csv(FEATURES_PATH, index=False)
     print(f"✅ Updated features with GW{args.gw} → {FEATURES_PATH}")
     print(f"Rows: {len(combined)}, Cols: {len(combined.columns)}")
+    print(f"Team-GW table: {len(team_gw)} rows → {TEAM_GW_PATH}")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file